@@ -34,7 +34,7 @@ from hifiberrydsp.server.constants import \
     COMMAND_WRITE_EEPROM_CONTENT, COMMAND_GET_META, \
     COMMAND_META_RESPONSE, COMMAND_GPIO, COMMAND_GPIO_RESPONSE, \
     DEFAULT_PORT, \
-    HEADER_SIZE, \
+    HEADER_SIZE, READ_HEADER, WRITE_HEADER, \
     SigmaTCPException
 
 
@@ -50,6 +50,9 @@ class SigmaTCPClient():
     def connect(self):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # the connection is kept open, detect dead peers
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
             self.socket.connect((self.ip, self.port))
         except IOError:
             self.socket = None
@@ -61,6 +64,20 @@ class SigmaTCPClient():
             self.socket.close()
             self.socket = None
 
+    def _recv_exact(self, length):
+        '''
+        Receive exactly length bytes, a single recv might return less
+        '''
+        data = bytearray(length)
+        view = memoryview(data)
+        received = 0
+        while received < length:
+            n = self.socket.recv_into(view[received:])
+            if n == 0:
+                raise SigmaTCPException("Connection closed by server")
+            received += n
+        return data
+
     def read_memory(self, addr, length):
         if self.socket is None:
             if self.autoconnect:
@@ -69,8 +86,8 @@ class SigmaTCPClient():
                 raise SigmaTCPException("Not connected")
 
         packet = self.read_request(addr, length)
-        self.socket.send(packet)
-        data = self.socket.recv(HEADER_SIZE + length)
+        self.socket.sendall(packet)
+        data = self._recv_exact(HEADER_SIZE + length)
         # remove the header
         data = data[HEADER_SIZE:]
         return data
@@ -83,8 +100,8 @@ class SigmaTCPClient():
                 raise SigmaTCPException("Not connected")
 
         packet = self.generic_request(COMMAND_CHECKSUM)
-        self.socket.send(packet)
-        data = self.socket.recv(HEADER_SIZE + 16)
+        self.socket.sendall(packet)
+        data = self._recv_exact(HEADER_SIZE + 16)
         # remove the header
         data = data[HEADER_SIZE:]
         return data
@@ -97,8 +114,8 @@ class SigmaTCPClient():
                 raise SigmaTCPException("Not connected")
 
         packet = self.gpio_request(rw, pin, value)
-        self.socket.send(packet)
-        data = self.socket.recv(HEADER_SIZE + 1)
+        self.socket.sendall(packet)
+        data = self._recv_exact(HEADER_SIZE + 1)
         # remove the header
         data = data[HEADER_SIZE:]
         return data
@@ -110,8 +127,17 @@ class SigmaTCPClient():
             else:
                 raise SigmaTCPException("Not connected")
 
-        packet = self.write_request(addr, data)
-        self.socket.send(packet)
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+
+        header = self.write_header(addr, len(data))
+        if hasattr(self.socket, "sendmsg"):
+            # send header and data without copying them into one packet
+            sent = self.socket.sendmsg([header, data])
+            if sent < len(header) + len(data):
+                self.socket.sendall((header + data)[sent:])
+        else:
+            self.socket.sendall(self.write_request(addr, data))
 
     def write_eeprom_from_file(self, filename):
         if self.socket is None:
@@ -122,8 +148,8 @@ class SigmaTCPClient():
 
         if (os.path.exists(filename)):
             packet = self.write_eeprom_file_request(os.path.abspath(filename))
-            self.socket.send(packet)
-            result = int.from_bytes(self.socket.recv(1),
+            self.socket.sendall(packet)
+            result = int.from_bytes(self._recv_exact(1),
                                     byteorder='big',
                                     signed=False)
             if result == 1:
@@ -141,8 +167,8 @@ class SigmaTCPClient():
                 raise SigmaTCPException("Not connected")
 
         packet = self.write_eeprom_content_request(xmldata)
-        self.socket.send(packet)
-        result = int.from_bytes(self.socket.recv(1),
+        self.socket.sendall(packet)
+        result = int.from_bytes(self._recv_exact(1),
                                 byteorder='big',
                                 signed=False)
         if result == 1:
@@ -169,36 +195,19 @@ class SigmaTCPClient():
     def write_biquad(self, start_addr, bq):
 
         bqn = bq.normalized()
-        bq_params = []
-        bq_params.append(-bqn.a1)
-        bq_params.append(-bqn.a2)
-        bq_params.append(bqn.b0)
-        bq_params.append(bqn.b1)
-        bq_params.append(bqn.b2)
-
-        reg = start_addr + 4
-        for param in bq_params:
-            self.write_decimal(reg, param)
-            reg = reg - 1
-
-        # reset a1/a2 to their original values
-        bq_params[0] = -bq_params[0]
-        bq_params[1] = -bq_params[1]
+        # coefficients are stored in consecutive registers starting with b2
+        payload = bytearray()
+        for param in [bqn.b2, bqn.b1, bqn.b0, -bqn.a2, -bqn.a1]:
+            payload += self.get_decimal_repr(param)
+
+        self.write_memory(start_addr, payload)
 
     def write_decibel(self, addr, db):
         amplification = pow(10, db / 20)
         self.write_decimal(addr, amplification)
 
     def read_request(self, addr, length):
-        packet = bytearray(HEADER_SIZE)
-        packet[0] = COMMAND_READ
-        packet[4] = 14  # packet length
-        packet[9] = length & 0xff
-        packet[8] = (length >> 8) & 0xff
-        packet[11] = addr & 0xff
-        packet[10] = (addr >> 8) & 0xff
-
-        return packet
+        return READ_HEADER.pack(COMMAND_READ, HEADER_SIZE, length, addr)
 
     @staticmethod
     def metadata_request(attribute):
@@ -222,21 +231,18 @@ class SigmaTCPClient():
         packet[16] = value
         return packet
 
+    @staticmethod
+    def write_header(addr, length):
+        return WRITE_HEADER.pack(COMMAND_WRITE, 0,
+                                 HEADER_SIZE + length, length, addr)
+
     @staticmethod
     def write_request(addr, data):
         length = len(data)
-        packet = bytearray(HEADER_SIZE)
-        packet[0] = COMMAND_WRITE
-        packet[11] = length & 0xff
-        packet[10] = (length >> 8) & 0xff
-        packet[13] = addr & 0xff
-        packet[12] = (addr >> 8) & 0xff
-        for d in data:
-            packet.append(d)
-
-        packet_length = len(packet)
-        packet[6] = packet_length & 0xff
-        packet[5] = (packet_length >> 8) & 0xff
+        packet = bytearray(HEADER_SIZE + length)
+        WRITE_HEADER.pack_into(packet, 0,
+                               COMMAND_WRITE, 0, len(packet), length, addr)
+        packet[HEADER_SIZE:] = data
 
         return packet
 
@@ -248,11 +254,11 @@ class SigmaTCPClient():
                 raise SigmaTCPException("Not connected")
 
         packet = self.generic_request(request_code)
-        self.socket.send(packet)
+        self.socket.sendall(packet)
 
         if response_code is not None:
             # read header and get length field
-            data = self.socket.recv(HEADER_SIZE)
+            data = self._recv_exact(HEADER_SIZE)
             length = int.from_bytes(data[6:10], byteorder='big')
 
             if (data[0] != response_code):
@@ -261,12 +267,7 @@ class SigmaTCPClient():
                               data[0])
 
             # read data
-            data = bytearray()
-            while (len(data) < length):
-                packet = self.socket.recv(length - len(data))
-                data = data + packet
-
-            return data
+            return self._recv_exact(length)
 
     def request_metadata(self, attribute):
         if self.socket is None:
@@ -276,9 +277,9 @@ class SigmaTCPClient():
                 raise SigmaTCPException("Not connected")
 
         packet = self.metadata_request(attribute)
-        self.socket.send(packet)
+        self.socket.sendall(packet)
 
-        data = self.socket.recv(HEADER_SIZE)
+        data = self._recv_exact(HEADER_SIZE)
         length = int.from_bytes(data[6:10], byteorder='big')
 
         if (data[0] != COMMAND_META_RESPONSE):
@@ -288,10 +289,7 @@ class SigmaTCPClient():
             return
 
         # read data
-        data = bytearray()
-        while (len(data) < length):
-            packet = self.socket.recv(length - len(data))
-            data = data + packet
+        data = self._recv_exact(length)
 
         return data.decode("utf-8")
 
@@ -299,9 +297,10 @@ class SigmaTCPClient():
     def write_eeprom_file_request(filename):
         packet = bytearray(HEADER_SIZE)
         packet[0] = COMMAND_EEPROM_FILE
+        filename = filename.encode("utf-8")
         packet[1] = len(filename)
-        packet.extend(map(ord, filename))
-        packet.extend([0])
+        packet += filename
+        packet.append(0)
         return packet
 
     @staticmethod
@@ -337,8 +336,4 @@ class SigmaTCPClient():
                               int_data(0, self.dsp.REGISTER_WORD_LENGTH))
 
     def data_int(self, data):
-        res = 0
-        for d in data:
-            res = res * 256
-            res += d
-        return res
+        return int.from_bytes(data, byteorder='big')
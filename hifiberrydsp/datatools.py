@@ -86,8 +86,7 @@ def parse_int_list(val):
 
 
 def int_data(intval, length=4):
-    octets = bytearray()
-    for i in range(length, 0, -1):
-        octets.append((intval >> (i - 1) * 8) & 0xff)
-
-    return octets
+    # mask first, values that don't fit (or negative values) are truncated
+    # to their lowest bytes
+    intval = intval & ((1 << (length * 8)) - 1)
+    return bytearray(intval.to_bytes(length, byteorder='big'))
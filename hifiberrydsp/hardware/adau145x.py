@@ -109,9 +109,9 @@ class Adau145x():
         
     @staticmethod
     def detect_dsp(debug=False):
-        SpiHandler.write(0xf890, [0], debug)
+        SpiHandler.write(0xf890, b'\x00', debug)
         time.sleep(1)
-        SpiHandler.write(0xf890, [1], debug)
+        SpiHandler.write(0xf890, b'\x01', debug)
         time.sleep(1)
         reg1 = int.from_bytes(SpiHandler.read(0xf000, 2), byteorder='big') # PLL feedback divider must be != 0
         reg2 = int.from_bytes(SpiHandler.read(0xc000, 2), byteorder='big') # Soft reset is expected to be 1 
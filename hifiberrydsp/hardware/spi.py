@@ -40,71 +40,56 @@ class SpiHandler():
     We assume that the SPI library is thread-safe and do not use 
     additional locking here.
 
-    Data is passed in bytearrays, not string or lists
+    Data is passed in bytearrays, not string or lists. Writes also accept
+    bytes and memoryviews.
     '''
 
     spi = init_spi()
 
+    # larger writes are split into multiple transfers
+    MAX_WRITE_LENGTH = 4000
+    # maximum number of bytes in a single read, a multiple of the word
+    # length that fits into the 4096 byte spidev buffer
+    MAX_READ_LENGTH = 4000
+
     @staticmethod
     def read(addr, length, debug=False):
-        spi_request = []
-        a0 = addr & 0xff
-        a1 = (addr >> 8) & 0xff
-
-        spi_request.append(1)
-        spi_request.append(a1)
-        spi_request.append(a0)
-
-        for _i in range(0, length):
-            spi_request.append(0)
+        spi_request = bytearray(length + 3)
+        spi_request[0] = 1
+        spi_request[1] = (addr >> 8) & 0xff
+        spi_request[2] = addr & 0xff
 
-        spi_response = SpiHandler.spi.xfer(spi_request)  # SPI read
+        spi_response = bytearray(SpiHandler.spi.xfer2(spi_request))  # SPI read
         if debug:
             logging.debug("spi read %s bytes from %s", len(spi_request), addr)
-        return bytearray(spi_response[3:])
+        # drop the command and address bytes
+        del spi_response[:3]
+        return spi_response
 
     @staticmethod
     def write(addr, data, debug=False):
-        a0 = addr & 0xff
-        a1 = (addr >> 8) & 0xff
-
-        spi_request = []
-        spi_request.append(0)
-        spi_request.append(a1)
-        spi_request.append(a0)
-        for d in data:
-            spi_request.append(d)
-
-        if len(spi_request) < 4096:
-            SpiHandler.spi.xfer(spi_request)
-            if debug:
-                logging.debug("spi write %s bytes",  len(spi_request) - 3)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data)
         else:
-            finished = False
-            while not finished:
-                if len(spi_request) < 4096:
-                    SpiHandler.spi.xfer(spi_request)
-                    if debug:
-                        logging.debug("spi write %s bytes",
-                                      len(spi_request) - 3)
-                    finished = True
-                else:
-                    short_request = spi_request[:4003]
-                    SpiHandler.spi.xfer(short_request)
-                    if debug:
-                        logging.debug("spi write %s bytes",
-                                      len(short_request) - 3)
-
-                    # skip forward 1000 cells
-                    addr = addr + 1000  # each memory cell is 4 bytes long
-                    a0 = addr & 0xff
-                    a1 = (addr >> 8) & 0xff
-                    new_request = []
-                    new_request.append(0)
-                    new_request.append(a1)
-                    new_request.append(a0)
-                    new_request.extend(spi_request[4003:])
-
-                    spi_request = new_request
+            view = memoryview(bytes(data))
+
+        offset = 0
+        while True:
+            chunk = view[offset:offset + SpiHandler.MAX_WRITE_LENGTH]
+            spi_request = bytearray(len(chunk) + 3)
+            spi_request[1] = (addr >> 8) & 0xff
+            spi_request[2] = addr & 0xff
+            spi_request[3:] = chunk
+
+            SpiHandler.spi.xfer2(spi_request)
+            if debug:
+                logging.debug("spi write %s bytes", len(chunk))
+
+            offset += len(chunk)
+            if offset >= len(view):
+                break
+
+            # each memory cell is 4 bytes long
+            addr = addr + len(chunk) // 4
 
         return data
@@ -19,6 +19,8 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
+import struct
+
 # Original SigmaDSP operations
 COMMAND_READ = 0x0a
 COMMAND_READRESPONSE = 0x0b
@@ -50,10 +52,21 @@ GPIO_RESET = 0
 
 HEADER_SIZE = 14
 
+# Header layouts
+# read request: command, header length, data length, address
+READ_HEADER = struct.Struct(">BIxIHxx")
+# write request: command, safeload, packet length, data length, address
+WRITE_HEADER = struct.Struct(">BBxIxIH")
+# response: command, header length, chip address, data length, address
+RESPONSE_HEADER = struct.Struct(">BIBIHxx")
+
 DEFAULT_PORT = 8086
 
 MAX_READ_SIZE = 1024 * 2
 
+# larger requests are rejected and the connection is closed
+MAX_FRAME_SIZE = 8 * 1024 * 1024
+
 ZEROCONF_TYPE = "_sigmatcp._tcp.local."
 
 
@@ -26,13 +26,16 @@ import os
 import sys
 import logging
 import hashlib
+import tempfile
 
-from threading import Thread
+from io import BytesIO
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
 
-from socketserver import BaseRequestHandler, TCPServer, ThreadingMixIn
+from socketserver import BaseRequestHandler, TCPServer
 
 # from zeroconf import ServiceInfo, Zeroconf
-import xmltodict
+from xml.etree import ElementTree
 import configparser
 import requests
 
@@ -53,8 +56,8 @@ from hifiberrydsp.server.constants import \
     COMMAND_META_RESPONSE, COMMAND_PROGMEM, COMMAND_PROGMEM_RESPONSE, \
     COMMAND_DATAMEM, COMMAND_DATAMEM_RESPONSE, \
     COMMAND_GPIO, \
-    HEADER_SIZE, \
-    DEFAULT_PORT
+    HEADER_SIZE, READ_HEADER, WRITE_HEADER, RESPONSE_HEADER, \
+    MAX_FRAME_SIZE, DEFAULT_PORT
 # import hifiberrydsp
 
 # URL to notify on DSP program updates
@@ -104,6 +107,12 @@ def startup_notify():
 class SigmaTCPHandler(BaseRequestHandler):
 
     checksum = None
+    # set if program memory might have changed since the last checksum
+    program_dirty = True
+    # incremented on every change of program memory, protected by
+    # program_lock
+    program_generation = 0
+    program_lock = Lock()
     spi = SpiHandler()
     dsp = adau145x.Adau145x
     dspprogramfile = dspprogramfile()
@@ -113,6 +122,8 @@ class SigmaTCPHandler(BaseRequestHandler):
     updating = False
     xml = None
     checksum_error = False
+    # default size of the receive buffer of a connection
+    receive_buffer_size = 65536
 
     def __init__(self, request, client_address, server):
         logging.debug("__init__")
@@ -120,202 +131,158 @@ class SigmaTCPHandler(BaseRequestHandler):
 
     def setup(self):
         logging.debug('setup')
+        # requests are small and latency-sensitive, don't wait for Nagle
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # a connection occupies a worker until it is closed, detect peers
+        # that disappeared without closing it (after about 2 minutes)
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 6)
+        # receive buffer, self.pos bytes of it are filled
+        self.buffer = bytearray(self.receive_buffer_size)
+        self.view = memoryview(self.buffer)
+        self.pos = 0
 
     def finish(self):
         logging.debug('finish')
 
-    def handle(self):
-        logging.debug('handle')
-        finished = False
-        data = None
-        read_more = False
+    def receive(self, length):
+        '''
+        Receive data from the client until at least length bytes are
+        in the receive buffer. Returns False if the connection was closed.
+        '''
+        if length > len(self.buffer):
+            # the request doesn't fit, move to a larger buffer
+            buffer = bytearray(length)
+            buffer[:self.pos] = self.view[:self.pos]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+
+        while self.pos < length:
+            received = self.request.recv_into(self.view[self.pos:])
+            if received == 0:
+                return False
+            self.pos += received
+
+        return True
+
+    def consume(self, length):
+        '''
+        Remove a processed request from the start of the receive buffer
+        '''
+        remaining = max(self.pos - length, 0)
 
-        while not(finished):
-            # Read dara
-            try:
-                buffer = None
-                result = None
+        if len(self.buffer) > self.receive_buffer_size and \
+                remaining <= self.receive_buffer_size:
+            # buffer has been grown for a large request, release it
+            buffer = bytearray(self.receive_buffer_size)
+            buffer[:remaining] = self.view[length:self.pos]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        elif remaining > 0:
+            self.view[:remaining] = self.view[length:self.pos]
 
-                if data is None:
-                    data = self.request.recv(65536)
-                    if len(data) == 0:
-                        finished = True
-                        continue
-
-                if read_more:
-                    logging.debug("waiting for more data")
-                    d2 = self.request.recv(65536)
-                    if (len(d2) == 0):
-                        time.sleep(0.1)
-                    data = data + d2
-                    read_more = False
-
-                # Not an expected header?
-                if len(data) > 0 and len(data) < 14:
-                    read_more = True
-                    continue
-
-                logging.debug("received request type %s", data[0])
-
-                if data[0] == COMMAND_READ:
-                    command_length = int.from_bytes(
-                        data[1:5], byteorder='big')
-                    if (command_length > 0) and (len(data) < command_length):
-                        read_more = True
-                        logging.debug(
-                            "Expect %s bytes from header information (read), but have only %s",
-                            command_length, len(data))
-                        continue
+        self.pos = remaining
 
-                    result = self.handle_read(data)
+    def command_length(self):
+        '''
+        Get the length of the request at the start of the receive buffer
+        from its header
+        '''
+        command = self.buffer[0]
+
+        if command in (COMMAND_GET_META, COMMAND_GPIO):
+            (_command, length, _data_length, _addr) = \
+                READ_HEADER.unpack_from(self.buffer)
+        elif command in (COMMAND_WRITE, COMMAND_WRITE_EEPROM_CONTENT):
+            (_command, _safeload, length, _data_length, _addr) = \
+                WRITE_HEADER.unpack_from(self.buffer)
+            if length == 0:
+                # Client might not implement length correctly and leave
+                # it empty, use everything received so far
+                length = self.pos
+        elif command == COMMAND_EEPROM_FILE:
+            # file name is terminated by a 0 byte
+            length = HEADER_SIZE + self.buffer[1] + 1
+        elif command in (COMMAND_READ,
+                         COMMAND_STORE_DATA, COMMAND_RESTORE_DATA,
+                         COMMAND_CHECKSUM, COMMAND_XML,
+                         COMMAND_PROGMEM, COMMAND_DATAMEM):
+            length = HEADER_SIZE
+        else:
+            # unknown request, drop everything received so far
+            length = self.pos
+
+        return max(length, HEADER_SIZE)
 
-                elif data[0] == COMMAND_WRITE:
-                    command_length = int.from_bytes(
-                        data[3:7], byteorder='big')
+    def read_frame(self):
+        '''
+        Read the next request from the client. Returns a memoryview of the
+        complete request (header and payload) or None if the connection
+        has been closed or the request is too large.
+        '''
+        if not self.receive(HEADER_SIZE):
+            return None
 
-                    logging.debug("Len (data, header info): %s %s",
-                                  len(data), command_length)
+        command_length = self.command_length()
+        logging.debug("received request type %s, %s bytes",
+                      self.buffer[0], command_length)
 
-                    if command_length < len(data):
-                        buffer = data[command_length:]
-                        data = data[0:command_length]
+        if command_length > MAX_FRAME_SIZE:
+            logging.error("request type %s with %s bytes exceeds the "
+                          "maximum of %s bytes, closing connection",
+                          self.buffer[0], command_length, MAX_FRAME_SIZE)
+            return None
 
-                    if (command_length > 0) and (len(data) < command_length):
-                        read_more = True
-                        logging.debug(
-                            "Expect %s bytes from header information (write), but have only %s",
-                            command_length, len(data))
-                        continue
+        if not self.receive(command_length):
+            return None
 
-                    self.handle_write(data)
-                    result = None
+        return self.view[:command_length]
 
-                elif data[0] == COMMAND_EEPROM_FILE:
-                    filename_length = data[1]
-                    filename = "".join(map(chr, data[14:14 + filename_length]))
-                    result = self.write_eeprom_file(filename)
-
-                elif data[0] == COMMAND_STORE_DATA:
-                    self.save_data_memory()
-
-                elif data[0] == COMMAND_RESTORE_DATA:
-                    self.restore_data_memory()
-
-                elif data[0] == COMMAND_CHECKSUM:
-                    result = self._response_packet(
-                        COMMAND_CHECKSUM_RESPONSE, 0, 16) + \
-                        self.program_checksum(cached=False)
-
-                elif data[0] == COMMAND_XML:
-                    try:
-                        data = self.get_and_check_xml()
-
-                    except IOError as e:
-                        logging.debug("IOerror when reading XML file: %s", e)
-                        data = None
-                    except Exception as e:
-                        logging.debug("Unexpected error when reading XML file: %s", e)
-                        logging.exception(e)
-                        data = None
-
-                    if data is not None:
-                        xml_bytes = data.encode()
-                        result = self._response_packet(
-                            COMMAND_XML_RESPONSE, 0, len(data)) + xml_bytes
-                    else:
-                        result = self._response_packet(
-                            COMMAND_XML_RESPONSE, 0, 0)
-
-                elif data[0] == COMMAND_PROGMEM:
-                    try:
-                        data = self.get_program_memory()
-                    except IOError:
-                        data = []  # empty response
-
-                    # format program memory dump
-                    dump = ""
-                    for i in range(0, len(data), 4):
-                        dump += "{:02X}{:02X}{:02X}{:02X}\n".format(
-                            data[i], data[i + 1], data[i + 2], data[i + 3])
-
-                    result = self._response_packet(
-                        COMMAND_PROGMEM_RESPONSE, 0, len(dump)) + \
-                        dump.encode('ascii')
-
-                elif data[0] == COMMAND_GPIO:
-                    logging.error("GPIO command not yet implemented")
-
-                elif data[0] == COMMAND_DATAMEM:
-                    try:
-                        data = self.get_data_memory()
-                    except IOError:
-                        data = []  # empty response
-
-                    # format program memory dump
-                    dump = ""
-                    for i in range(0, len(data), 4):
-                        dump += "{:02X}{:02X}{:02X}{:02X}\n".format(
-                            data[i], data[i + 1], data[i + 2], data[i + 3])
-
-                    result = self._response_packet(
-                        COMMAND_DATAMEM_RESPONSE, 0, len(dump)) + \
-                        dump.encode('ascii')
-
-                elif data[0] == COMMAND_GET_META:
-                    length = int.from_bytes(data[1:5], byteorder='big')
-
-                    if length < len(data):
-                        buffer = data[command_length:]
-                        data = data[0:command_length]
-
-                    attribute = data[14:length].decode("utf-8")
-                    value = self.get_meta(attribute)
-                    logging.debug("metadata request for %s = %s",
-                                  attribute, value)
-
-                    if value is None:
-                        value = ""
-
-                    value = value.encode('utf-8')
-
-                    result = self._response_packet(
-                        COMMAND_META_RESPONSE, 0, len(value))
-                    result += value
-
-                elif data[0] == COMMAND_WRITE_EEPROM_CONTENT:
-                    command_length = int.from_bytes(
-                        data[3:7], byteorder='big')
-
-                    logging.debug("Len (data, header info): %s %s",
-                                  len(data), command_length)
-
-                    if command_length < len(data):
-                        buffer = data[command_length:]
-                        data = data[0:command_length]
-
-                    if (command_length > 0) and (len(data) < command_length):
-                        read_more = True
-                        logging.debug(
-                            "Expect %s bytes from header information (write), but have only %s", command_length, len(data))
-                        continue
+    def handle(self):
+        logging.debug('handle')
+        handlers = {
+            COMMAND_READ: self.handle_read,
+            COMMAND_WRITE: self.handle_write,
+            COMMAND_EEPROM_FILE: self.handle_eeprom_file,
+            COMMAND_STORE_DATA: self.handle_store_data,
+            COMMAND_RESTORE_DATA: self.handle_restore_data,
+            COMMAND_CHECKSUM: self.handle_checksum,
+            COMMAND_XML: self.handle_xml,
+            COMMAND_PROGMEM: self.handle_progmem,
+            COMMAND_DATAMEM: self.handle_datamem,
+            COMMAND_GPIO: self.handle_gpio,
+            COMMAND_GET_META: self.handle_get_meta,
+            COMMAND_WRITE_EEPROM_CONTENT: self.handle_eeprom_content,
+        }
+
+        while True:
+            try:
+                data = self.read_frame()
+                if data is None:
+                    break
 
-                    result = self.write_eeprom_content(data[14:command_length])
+                handler = handlers.get(data[0])
+                if handler is not None:
+                    result = handler(data)
+                else:
+                    logging.debug("ignoring unknown request type %s", data[0])
+                    result = None
 
                 if (result is not None) and (len(result) > 0):
                     logging.debug(
                         "Sending %s bytes answer to client", len(result))
-                    self.request.send(result)
+                    self.request.sendall(result)
 
-                # Still got data that hasn't been processed?
-                if buffer is not None:
-                    data = buffer
-                else:
-                    data = None
+                # Keep data of following requests that has been received
+                self.consume(len(data))
 
             except ConnectionResetError:
-                finished = True
+                break
             except BrokenPipeError:
-                finished = True
+                break
 
     @staticmethod
     def read_xml_profile():
@@ -382,8 +349,8 @@ class SigmaTCPHandler(BaseRequestHandler):
 
     @staticmethod
     def handle_read(data):
-        addr = int.from_bytes(data[10:12], byteorder='big')
-        length = int.from_bytes(data[6:10], byteorder='big')
+        (_command, _header_length, length, addr) = \
+            READ_HEADER.unpack_from(data)
         
         logging.debug("Handle read %s/%s",addr,length)
 
@@ -402,23 +369,30 @@ class SigmaTCPHandler(BaseRequestHandler):
             logging.error("Got incorrect write request, length < 14 bytes")
             return None
 
-        addr = int.from_bytes(data[12:14], byteorder='big')
-        length = int.from_bytes(data[8:12], byteorder='big')
+        # TODO: use safeload
+        (_command, _safeload, _packet_length, length, addr) = \
+            WRITE_HEADER.unpack_from(data)
         if (length == 0):
             # Client might not implement length correctly and leave
             # it empty
-            length = len(data) - 14
-
-        _safeload = data[1]  # TODO: use this
+            length = len(data) - HEADER_SIZE
 
         if addr == SigmaTCPHandler.dsp.KILLCORE_REGISTER and not(SigmaTCPHandler.updating):
             logging.debug(
                 "write to KILLCORE seen, guessing something is updating the DSP")
             SigmaTCPHandler.prepare_update()
 
+        dsp = SigmaTCPHandler.dsp
+        if (addr < dsp.PROGRAM_ADDR + dsp.PROGRAM_LENGTH and
+                addr + (length + dsp.WORD_LENGTH - 1) // dsp.WORD_LENGTH >
+                dsp.PROGRAM_ADDR) or \
+                addr == dsp.RESET_REGISTER:
+            SigmaTCPHandler.mark_program_dirty()
+
         logging.debug("writing {} bytes to {}".format(length, addr))
-        memdata = data[14:]
-        res = SigmaTCPHandler.spi.write(addr, memdata)
+        # no copy, the payload is passed to the SPI layer as a view
+        memdata = memoryview(data)[HEADER_SIZE:HEADER_SIZE + length]
+        SigmaTCPHandler.spi.write(addr, memdata)
 
         if addr == SigmaTCPHandler.dsp.HIBERNATE_REGISTER and \
                 SigmaTCPHandler.updating and memdata == b'\00\00':
@@ -426,28 +400,133 @@ class SigmaTCPHandler(BaseRequestHandler):
                 "set HIBERNATE to 0 seen, guessing update is done")
             SigmaTCPHandler.finish_update()
 
-        return res
+        # write requests don't get an answer
+        return None
+
+    @staticmethod
+    def handle_eeprom_file(data):
+        filename_length = data[1]
+        filename = bytes(data[14:14 + filename_length]).decode(
+            "utf-8", errors="replace")
+        return SigmaTCPHandler.write_eeprom_file(filename)
+
+    @staticmethod
+    def handle_eeprom_content(data):
+        return SigmaTCPHandler.write_eeprom_content(bytes(data[14:]))
+
+    @staticmethod
+    def handle_store_data(_data):
+        SigmaTCPHandler.save_data_memory()
+
+    @staticmethod
+    def handle_restore_data(_data):
+        SigmaTCPHandler.restore_data_memory()
+
+    @staticmethod
+    def handle_checksum(_data):
+        return SigmaTCPHandler._response_packet(
+            COMMAND_CHECKSUM_RESPONSE, 0, 16) + \
+            SigmaTCPHandler.program_checksum(cached=False)
+
+    @staticmethod
+    def handle_xml(_data):
+        try:
+            xml = SigmaTCPHandler.get_and_check_xml()
+
+        except IOError as e:
+            logging.debug("IOerror when reading XML file: %s", e)
+            xml = None
+        except Exception as e:
+            logging.debug("Unexpected error when reading XML file: %s", e)
+            logging.exception(e)
+            xml = None
+
+        if xml is not None:
+            xml_bytes = xml.encode()
+            return SigmaTCPHandler._response_packet(
+                COMMAND_XML_RESPONSE, 0, len(xml)) + xml_bytes
+        else:
+            return SigmaTCPHandler._response_packet(
+                COMMAND_XML_RESPONSE, 0, 0)
+
+    @staticmethod
+    def handle_progmem(_data):
+        try:
+            memory = SigmaTCPHandler.get_program_memory()
+        except IOError:
+            memory = []  # empty response
+
+        return SigmaTCPHandler._memory_dump(COMMAND_PROGMEM_RESPONSE, memory)
+
+    @staticmethod
+    def handle_datamem(_data):
+        try:
+            memory = SigmaTCPHandler.get_data_memory()
+        except IOError:
+            memory = []  # empty response
+
+        return SigmaTCPHandler._memory_dump(COMMAND_DATAMEM_RESPONSE, memory)
+
+    @staticmethod
+    def handle_gpio(_data):
+        logging.error("GPIO command not yet implemented")
+
+    @staticmethod
+    def handle_get_meta(data):
+        attribute = bytes(data[14:]).decode("utf-8")
+        value = SigmaTCPHandler.get_meta(attribute)
+        logging.debug("metadata request for %s = %s",
+                      attribute, value)
+
+        if value is None:
+            value = ""
+
+        value = value.encode('utf-8')
+
+        return SigmaTCPHandler._response_packet(
+            COMMAND_META_RESPONSE, 0, len(value)) + value
+
+    @staticmethod
+    def eeprom_actions(source):
+        '''
+        Parse the actions from an EEPROM XML file. source can be a file name
+        or a file object. Elements are discarded as soon as they have been
+        parsed, only the instructions and their data are kept.
+        '''
+        actions = []
+        for _event, elem in ElementTree.iterparse(source):
+            if elem.tag != "action":
+                continue
+
+            instr = elem.get("instr")
+            if instr == "writeXbytes":
+                actions.append((instr,
+                                int(elem.get("addr")),
+                                elem.get("ParamName"),
+                                bytes.fromhex(elem.text)))
+            elif instr == "delay":
+                actions.append((instr, None, None, None))
+
+            elem.clear()
+
+        return actions
 
     @staticmethod
     def write_eeprom_content(xmldata):
 
-        logging.info("writing XML file: %s", xmldata)
+        if (isinstance(xmldata, str)):
+            xmldata = xmldata.encode("utf-8")
+
+        logging.info("writing XML file (%s bytes)", len(xmldata))
 
         try:
-            doc = xmltodict.parse(xmldata)
+            # parse the complete file before anything is written to the DSP
+            actions = SigmaTCPHandler.eeprom_actions(BytesIO(xmldata))
 
             SigmaTCPHandler.prepare_update()
-            for action in doc["ROM"]["page"]["action"]:
-                instr = action["@instr"]
+            for (instr, addr, paramname, data) in actions:
 
                 if instr == "writeXbytes":
-                    addr = int(action["@addr"])
-                    paramname = action["@ParamName"]
-                    data = []
-                    for d in action["#text"].split(" "):
-                        value = int(d, 16)
-                        data.append(value)
-
                     logging.debug("writeXbytes %s %s", addr, len(data))
                     SigmaTCPHandler.spi.write(addr, data)
 
@@ -469,11 +548,7 @@ class SigmaTCPHandler(BaseRequestHandler):
 
             SigmaTCPHandler.finish_update()
 
-            # Write current DSP profile
-            with open(SigmaTCPHandler.dspprogramfile, "w+b") as dspprogram:
-                if (isinstance(xmldata, str)):
-                    xmldata = xmldata.encode("utf-8")
-                dspprogram.write(xmldata)
+            SigmaTCPHandler.write_dspprogramfile(xmldata)
 
         except Exception as e:
             logging.error("exception during EEPROM write: %s", e)
@@ -482,12 +557,40 @@ class SigmaTCPHandler(BaseRequestHandler):
 
         return b'\01'
 
+    @staticmethod
+    def write_dspprogramfile(xmldata):
+        '''
+        Write current DSP profile, replace the old one only when
+        the new file is complete
+        '''
+        dspprogramfile = SigmaTCPHandler.dspprogramfile
+        # every call uses its own temporary file, concurrent writes can't
+        # mix their data
+        dspprogram = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(os.path.abspath(dspprogramfile)),
+            prefix=os.path.basename(dspprogramfile) + ".",
+            suffix=".tmp",
+            delete=False)
+
+        try:
+            with dspprogram:
+                dspprogram.write(xmldata)
+            # NamedTemporaryFile creates the file readable by the owner only
+            os.chmod(dspprogram.name, 0o644)
+            os.replace(dspprogram.name, dspprogramfile)
+        except:
+            try:
+                os.remove(dspprogram.name)
+            except OSError:
+                pass
+            raise
+
     @staticmethod
     def write_eeprom_file(filename):
         try:
-            with open(filename) as fd:
+            with open(filename, "rb") as fd:
                 data = fd.read()
-                return SigmaTCPHandler.write_eeprom_content(data)
+            return SigmaTCPHandler.write_eeprom_content(data)
         except IOError as e:
             logging.debug("IOError: %s", e)
             return b'\00'
@@ -528,30 +631,33 @@ class SigmaTCPHandler(BaseRequestHandler):
 
     @staticmethod
     def get_memory_block(addr, length):
-        block_size = 2048
+        # read as much as possible in a single SPI transfer
+        block_size = SigmaTCPHandler.spi.MAX_READ_LENGTH
 
         dsp = SigmaTCPHandler.dsp
+        memory_length = length * dsp.WORD_LENGTH
 
-        logging.debug("reading %s bytes from memory",
-                      length * dsp.WORD_LENGTH)
+        logging.debug("reading %s bytes from memory", memory_length)
 
         # Must kill the core to read program memory, but it doesn't
         # hurt doing it also for other memory types :(
         SigmaTCPHandler._kill_dsp()
 
-        memory = bytearray()
+        memory = bytearray(memory_length)
+        offset = 0
 
-        while len(memory) < length * dsp.WORD_LENGTH:
+        while offset < memory_length:
             logging.debug("reading memory code block from addr %s", addr)
-            data = SigmaTCPHandler.spi.read(addr, block_size)
-            # logging.debug("%s", data)
-            memory += data
-            addr = addr + int(block_size / dsp.WORD_LENGTH)
+            read_length = min(block_size, memory_length - offset)
+            memory[offset:offset + read_length] = \
+                SigmaTCPHandler.spi.read(addr, read_length)
+            offset += read_length
+            addr = addr + read_length // dsp.WORD_LENGTH
 
         # Restart the core
         SigmaTCPHandler._start_dsp()
 
-        return memory[0:length * dsp.WORD_LENGTH]
+        return memory
 
     @staticmethod
     def get_program_memory():
@@ -565,11 +671,7 @@ class SigmaTCPHandler(BaseRequestHandler):
         end_index = memory.find(dsp.PROGRAM_END_SIGNATURE)
 
         if end_index < 0:
-            memsum = 0
-            for i in memory:
-                memsum = memsum + i
-
-            if (memsum > 0):
+            if any(memory):
                 logging.error("couldn't find program end signature," +
                               " using full program memory")
                 end_index = dsp.PROGRAM_LENGTH - dsp.WORD_LENGTH
@@ -583,8 +685,8 @@ class SigmaTCPHandler(BaseRequestHandler):
         logging.debug("Program lengths = %s words",
                       end_index / dsp.WORD_LENGTH)
 
-        # logging.debug("%s", memory[0:end_index])
-        return memory[0:end_index]
+        del memory[end_index:]
+        return memory
 
     @staticmethod
     def get_data_memory():
@@ -602,24 +704,57 @@ class SigmaTCPHandler(BaseRequestHandler):
 
     @staticmethod
     def program_checksum(cached=True):
+        '''
+        MD5 checksum of the program memory of the DSP
+
+        With cached=True, a previously calculated checksum is always used.
+        With cached=False, it is only used if no write to program memory
+        or the reset register has been seen since it was calculated.
+        Program memory is read again otherwise, which stops the DSP core
+        for a short time.
+        '''
         if cached and SigmaTCPHandler.checksum is not None:
             logging.debug("using cached program checksum, "
                           "might not always be correct")
             return SigmaTCPHandler.checksum
 
+        if not(SigmaTCPHandler.program_dirty) and \
+                SigmaTCPHandler.checksum is not None:
+            logging.debug("program memory unchanged, using cached checksum")
+            return SigmaTCPHandler.checksum
+
+        with SigmaTCPHandler.program_lock:
+            generation = SigmaTCPHandler.program_generation
+
         data = SigmaTCPHandler.get_program_memory()
         m = hashlib.md5()
         try:
-            m.update(data)
+            m.update(memoryview(data))
         except:
             logging.error("Can't calculate checksum from %s", data)
             return None
 
-        logging.debug("length: %s, digest: %s", len(data), m.digest())
+        checksum = m.digest()
+        logging.debug("length: %s, digest: %s", len(data), checksum)
+
+        # program memory might have changed while it was read, in this
+        # case the checksum is returned, but not cached
+        with SigmaTCPHandler.program_lock:
+            if SigmaTCPHandler.program_generation == generation:
+                logging.info("caching program memory checksum")
+                SigmaTCPHandler.checksum = checksum
+                SigmaTCPHandler.program_dirty = False
 
-        logging.info("caching program memory checksum")
-        SigmaTCPHandler.checksum = m.digest()
-        return SigmaTCPHandler.checksum
+        return checksum
+
+    @staticmethod
+    def mark_program_dirty():
+        '''
+        Call this method if program memory might have changed
+        '''
+        with SigmaTCPHandler.program_lock:
+            SigmaTCPHandler.program_generation += 1
+            SigmaTCPHandler.program_dirty = True
 
     @staticmethod
     def _list_str(int_list):
@@ -628,20 +763,19 @@ class SigmaTCPHandler(BaseRequestHandler):
 
     @staticmethod
     def _response_packet(command, addr, data_length):
-        packet = bytearray(HEADER_SIZE)
-        packet[0] = command
-        packet[4] = 14  # header length
-        packet[5] = 1  # chip address
-
-        packet[9] = data_length & 0xff
-        packet[8] = (data_length >> 8) & 0xff
-        packet[7] = (data_length >> 16) & 0xff
-        packet[6] = (data_length >> 24) & 0xff
+        # header length 14, chip address 1
+        return RESPONSE_HEADER.pack(command, HEADER_SIZE, 1,
+                                    data_length, addr)
 
-        packet[11] = addr & 0xff
-        packet[10] = (addr >> 8) & 0xff
+    @staticmethod
+    def _memory_dump(command, memory):
+        # format memory dump, one 32bit word per line
+        dump = "".join(["{:02X}{:02X}{:02X}{:02X}\n".format(
+            memory[i], memory[i + 1], memory[i + 2], memory[i + 3])
+            for i in range(0, len(memory), 4)])
 
-        return packet
+        return SigmaTCPHandler._response_packet(command, 0, len(dump)) + \
+            dump.encode('ascii')
 
     @staticmethod
     def _kill_dsp():
@@ -698,6 +832,7 @@ class SigmaTCPHandler(BaseRequestHandler):
         Call this method if the DSP program might change soon
         '''
         logging.info("preparing for memory update")
+        SigmaTCPHandler.mark_program_dirty()
         SigmaTCPHandler.checksum = None
         SigmaTCPHandler.update_alsasync(clear=True)
         SigmaTCPHandler.update_lgsoundsync(clear=True)
@@ -774,21 +909,67 @@ class ProgramRefresher(Thread):
             
 
 
-class SigmaTCPServer(ThreadingMixIn, TCPServer):
+class SigmaTCPServer(TCPServer):
+    '''
+    TCP server that handles connections in a fixed-size thread pool
+    instead of starting a new thread for every connection
+    '''
+
+    # default maximum number of clients that are served at the same time
+    max_workers = 8
 
     def __init__(self,
                  server_address=("0.0.0.0", DEFAULT_PORT),
-                 RequestHandlerClass=SigmaTCPHandler):
+                 RequestHandlerClass=SigmaTCPHandler,
+                 max_workers=None):
         self.allow_reuse_address = True
+        if max_workers is not None:
+            self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        # connections that are served or waiting for a worker
+        self.connections = set()
+        self.connections_lock = Lock()
 
         TCPServer.__init__(self, server_address, RequestHandlerClass)
 
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.connections_lock:
+                self.connections.discard(request)
+            self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            if len(self.connections) >= self.max_workers:
+                logging.warning("all %s workers busy, connection from %s "
+                                "waits until another client disconnects, "
+                                "see max_workers in /etc/sigmatcp.conf",
+                                self.max_workers, client_address)
+            self.connections.add(request)
+
+        self.pool.submit(self.process_request_thread, request, client_address)
+
     def server_activate(self):
         TCPServer.server_activate(self)
 
     def server_close(self):
         TCPServer.server_close(self)
 
+        # Pool threads can't be daemon threads. Close open connections,
+        # so workers waiting for data return and the process can exit.
+        with self.connections_lock:
+            for request in self.connections:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        self.pool.shutdown(wait=False)
+
 
 class SigmaTCPServerMain():
 
@@ -797,9 +978,9 @@ class SigmaTCPServerMain():
         self.abort = False
         self.zeroconf = None
 
-        self.server = SigmaTCPServer()
-        
         params = self.parse_config()
+
+        self.server = SigmaTCPServer(max_workers=params["max_workers"])
         if params["alsa"]:
             logging.info("initializing ALSA mixer control %s", alsa_mixer_name)
             alsasync = AlsaSync()
@@ -869,6 +1050,16 @@ class SigmaTCPServerMain():
             this.notify_on_updates = config.get("server","notify_on_updates") 
         except:
             this.notify_on_updates = None
+
+        try:
+            params["max_workers"] = config.getint("server", "max_workers")
+        except:
+            params["max_workers"] = SigmaTCPServer.max_workers
+
+        if params["max_workers"] < 1:
+            logging.error("max_workers must be at least 1, using %s",
+                          SigmaTCPServer.max_workers)
+            params["max_workers"] = SigmaTCPServer.max_workers
             
 
 
@@ -0,0 +1,306 @@
+'''
+Copyright (c) 2018 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import hashlib
+import socket
+import sys
+import threading
+import time
+import types
+import unittest
+
+
+class FakeSpiDev():
+    '''
+    Stands in for spidev.SpiDev, SpiHandler opens the SPI device on import
+    '''
+
+    def open(self, bus, device):
+        pass
+
+    def xfer2(self, data):
+        return list(data)
+
+
+if "hifiberrydsp.hardware.spi" not in sys.modules:
+    spidev = types.ModuleType("spidev")
+    spidev.SpiDev = FakeSpiDev
+    sys.modules["spidev"] = spidev
+
+from hifiberrydsp.client.sigmatcp import SigmaTCPClient
+from hifiberrydsp.hardware import adau145x
+from hifiberrydsp.server.sigmatcp import SigmaTCPHandler
+from hifiberrydsp.server.constants import \
+    COMMAND_READRESPONSE, COMMAND_WRITE, MAX_FRAME_SIZE
+
+
+class FakeSpi():
+    '''
+    Records writes, reads return the low byte of the address
+    '''
+
+    def __init__(self):
+        self.writes = []
+
+    def read(self, addr, length):
+        return bytearray([addr & 0xff] * length)
+
+    def write(self, addr, data):
+        self.writes.append((addr, bytes(data)))
+        return data
+
+
+class RecordingHandler(SigmaTCPHandler):
+
+    instances = []
+
+    def setup(self):
+        SigmaTCPHandler.setup(self)
+        RecordingHandler.instances.append(self)
+
+
+def serve(connection, address):
+    # like SigmaTCPServer, close the connection when the handler returns
+    try:
+        RecordingHandler(connection, address, None)
+    finally:
+        connection.close()
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.spi = FakeSpi()
+        self.original_spi = SigmaTCPHandler.spi
+        SigmaTCPHandler.spi = self.spi
+        RecordingHandler.instances = []
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        self.socket = socket.create_connection(listener.getsockname())
+        (connection, address) = listener.accept()
+        listener.close()
+
+        self.thread = threading.Thread(target=serve,
+                                       args=(connection, address))
+        self.thread.start()
+
+        self.client = SigmaTCPClient(None, "127.0.0.1")
+        self.client.socket = self.socket
+
+    def tearDown(self):
+        self.socket.close()
+        self.thread.join(5)
+        SigmaTCPHandler.spi = self.original_spi
+
+    def sync(self):
+        # requests are handled in order, a read is answered only after
+        # all previous requests have been processed
+        self.assertEqual(self.client.read_memory(0x10, 2), b'\x10\x10')
+
+    def waitForWrites(self, count):
+        timeout = time.time() + 5
+        while len(self.spi.writes) < count and time.time() < timeout:
+            time.sleep(0.01)
+
+    def testPipelinedRequests(self):
+        self.socket.sendall(
+            SigmaTCPClient.write_request(0x100, b'\x01\x02\x03\x04') +
+            SigmaTCPClient.write_request(0x200, b'\x05\x06\x07\x08') +
+            self.client.read_request(0x20, 4))
+
+        self.assertEqual(self.client._recv_exact(18)[14:], b'\x20' * 4)
+        self.assertEqual(self.spi.writes,
+                         [(0x100, b'\x01\x02\x03\x04'),
+                          (0x200, b'\x05\x06\x07\x08')])
+
+    def testSplitFrame(self):
+        packet = SigmaTCPClient.write_request(0x100, bytes(range(100)))
+        for part in (packet[:5], packet[5:20], packet[20:]):
+            self.socket.sendall(part)
+            time.sleep(0.05)
+
+        self.sync()
+        self.assertEqual(self.spi.writes, [(0x100, bytes(range(100)))])
+
+    def testLargeWrite(self):
+        data = bytes(range(256)) * 400
+        self.client.write_memory(0x300, data)
+
+        self.sync()
+        self.assertEqual(self.spi.writes, [(0x300, data)])
+
+        # the receive buffer goes back to its default size
+        handler = RecordingHandler.instances[0]
+        self.assertEqual(len(handler.buffer),
+                         SigmaTCPHandler.receive_buffer_size)
+
+    def testWriteWithoutPacketLength(self):
+        packet = SigmaTCPClient.write_request(0x100, b'\x01\x02\x03\x04')
+        packet[3:7] = bytes(4)
+        self.socket.sendall(packet)
+
+        self.waitForWrites(1)
+        self.sync()
+        self.assertEqual(self.spi.writes, [(0x100, b'\x01\x02\x03\x04')])
+
+    def testGetMetaFrame(self):
+        original_get_meta = SigmaTCPHandler.get_meta
+        SigmaTCPHandler.get_meta = staticmethod(lambda attribute:
+                                                "value of " + attribute)
+        try:
+            self.assertEqual(self.client.request_metadata("volumeControl"),
+                             "value of volumeControl")
+        finally:
+            SigmaTCPHandler.get_meta = original_get_meta
+
+        self.sync()
+
+    def testGpioFrame(self):
+        # not implemented, but the frame must be skipped completely
+        self.socket.sendall(SigmaTCPClient.gpio_request(0, 1, 1))
+        self.sync()
+
+    def testReadIgnoresLengthField(self):
+        packet = bytearray(self.client.read_request(0x20, 2))
+        packet[1:5] = (300 * 1024 * 1024).to_bytes(4, byteorder='big')
+        self.socket.sendall(packet)
+
+        response = self.client._recv_exact(16)
+        self.assertEqual(response[0], COMMAND_READRESPONSE)
+        self.assertEqual(response[14:], b'\x20\x20')
+
+    def testOversizedFrameClosesConnection(self):
+        header = SigmaTCPClient.write_header(0x100, MAX_FRAME_SIZE)
+        self.assertEqual(header[0], COMMAND_WRITE)
+        self.socket.sendall(header)
+
+        self.socket.settimeout(5)
+        self.assertEqual(self.socket.recv(1), b'')
+        self.assertEqual(self.spi.writes, [])
+
+
+class ChecksumTest(unittest.TestCase):
+    '''
+    Caching of the program memory checksum
+    '''
+
+    program = bytearray(b'\x01\x02\x03\x04')
+    checksum = hashlib.md5(program).digest()
+
+    def setUp(self):
+        self.original = (SigmaTCPHandler.spi,
+                         SigmaTCPHandler.checksum,
+                         SigmaTCPHandler.program_dirty,
+                         SigmaTCPHandler.__dict__["get_program_memory"])
+        SigmaTCPHandler.spi = FakeSpi()
+        self.reads = 0
+        SigmaTCPHandler.get_program_memory = staticmethod(self.program_memory)
+
+        self.assertEqual(SigmaTCPHandler.program_checksum(cached=False),
+                         self.checksum)
+        self.assertEqual(self.reads, 1)
+        self.assertFalse(SigmaTCPHandler.program_dirty)
+
+    def tearDown(self):
+        (SigmaTCPHandler.spi,
+         SigmaTCPHandler.checksum,
+         SigmaTCPHandler.program_dirty,
+         SigmaTCPHandler.get_program_memory) = self.original
+
+    def program_memory(self):
+        self.reads += 1
+        return self.program
+
+    def failing_program_memory(self):
+        self.reads += 1
+        raise OSError("SPI read failed")
+
+    def write(self, addr, data):
+        SigmaTCPHandler.handle_write(SigmaTCPClient.write_request(addr, data))
+
+    def testUnchanged(self):
+        self.write(adau145x.Adau145x.PROGRAM_ADDR - 1, b'\x00' * 4)
+        self.assertEqual(SigmaTCPHandler.program_checksum(cached=False),
+                         self.checksum)
+        self.assertEqual(self.reads, 1)
+
+    def testProgramWrite(self):
+        # a write of less than a word still changes program memory
+        self.write(adau145x.Adau145x.PROGRAM_ADDR, b'\x00')
+        self.assertTrue(SigmaTCPHandler.program_dirty)
+        SigmaTCPHandler.program_checksum(cached=False)
+        self.assertEqual(self.reads, 2)
+
+    def testResetWrite(self):
+        self.write(adau145x.Adau145x.RESET_REGISTER, b'\x00\x01')
+        self.assertTrue(SigmaTCPHandler.program_dirty)
+        SigmaTCPHandler.program_checksum(cached=False)
+        self.assertEqual(self.reads, 2)
+
+    def testFailingRead(self):
+        self.write(adau145x.Adau145x.PROGRAM_ADDR, b'\x00' * 4)
+        SigmaTCPHandler.get_program_memory = \
+            staticmethod(self.failing_program_memory)
+        with self.assertRaises(OSError):
+            SigmaTCPHandler.program_checksum(cached=False)
+
+        # the old checksum must not be used after a failed read
+        self.assertTrue(SigmaTCPHandler.program_dirty)
+        with self.assertRaises(OSError):
+            SigmaTCPHandler.program_checksum(cached=False)
+        self.assertEqual(self.reads, 3)
+
+
+class HeaderTest(unittest.TestCase):
+    '''
+    Wire format of the request and response headers
+    '''
+
+    def testReadRequest(self):
+        self.assertEqual(
+            SigmaTCPClient(None, "127.0.0.1").read_request(0x1234, 0x0567),
+            bytes([0x0a, 0, 0, 0, 14, 0, 0, 0, 0x05, 0x67, 0x12, 0x34, 0, 0]))
+
+    def testWriteRequest(self):
+        header = bytes([0x09, 0, 0, 0, 0, 0, 18, 0, 0, 0, 0, 4, 0x12, 0x34])
+        self.assertEqual(SigmaTCPClient.write_header(0x1234, 4), header)
+        self.assertEqual(
+            SigmaTCPClient.write_request(0x1234, b'\x01\x02\x03\x04'),
+            header + b'\x01\x02\x03\x04')
+
+        # packet length 1014, data length 1000
+        self.assertEqual(
+            SigmaTCPClient.write_header(0xc000, 1000),
+            bytes([0x09, 0, 0, 0, 0, 0x03, 0xf6, 0, 0, 0, 0x03, 0xe8,
+                   0xc0, 0x00]))
+
+    def testResponsePacket(self):
+        self.assertEqual(
+            SigmaTCPHandler._response_packet(COMMAND_READRESPONSE,
+                                             0x1234, 0x01020304),
+            bytes([0x0b, 0, 0, 0, 14, 1, 0x01, 0x02, 0x03, 0x04,
+                   0x12, 0x34, 0, 0]))
+
+
+if __name__ == "__main__":
+    unittest.main()